@@ -1,12 +1,27 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for, flash
+from flask import Flask, Response, request, jsonify, render_template, redirect, url_for, flash, stream_with_context
 from flask_cors import CORS
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager, UserMixin, login_user, login_required, current_user, logout_user
+from werkzeug.middleware.proxy_fix import ProxyFix
 from dotenv import load_dotenv
-from supabase import create_client, Client
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import base64
+import hashlib
+import json
 import os
 
+from auth import HasherBusy, LoginThrottle, PasswordHasher
+from metrics import InstrumentedStorage, Metrics, phase
+from mood_codec import (
+    CATEGORIZED_MOODS, TREND_FRAMES, DecodedMoodCache, mood_sort_key, parse_timestamp, split_moods,
+    trend_series, trend_start,
+)
+from rollups import MoodRollup, RETENTION_SECONDS
+from storage import create_storage
+from user_cache import UserCache
+from write_queue import WriteBehindQueue
+
 # Load environment variables
 load_dotenv()
 
@@ -15,15 +30,60 @@ app = Flask(__name__)
 CORS(app, origins=["*"])  # Allow all domains for debugging purposes
 app.secret_key = os.getenv("SECRET_KEY", "supersecretkey")  # Replace with a strong secret key
 
+# Behind a load balancer, take the client address from X-Forwarded-For, trusting
+# only as many hops as there are proxies we run
+trusted_proxies = int(os.getenv("TRUSTED_PROXY_COUNT", "0"))
+if trusted_proxies:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies)
+
+# bcrypt cost factor, read by Flask-Bcrypt
+app.config["BCRYPT_LOG_ROUNDS"] = int(os.getenv("BCRYPT_LOG_ROUNDS", "12"))
+
 # Flask extensions
 bcrypt = Bcrypt(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
-# Supabase setup
-url = os.getenv("SUPABASE_URL")
-key = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
+# Hash and verify passwords in a bounded pool, and rate-limit login attempts
+password_hasher = PasswordHasher(
+    bcrypt,
+    workers=int(os.getenv("BCRYPT_WORKERS", "2")),
+    max_pending=int(os.getenv("BCRYPT_MAX_PENDING", "8")),
+    wait_timeout=float(os.getenv("BCRYPT_WAIT_TIMEOUT", "5")),
+)
+login_throttle = LoginThrottle(
+    max_attempts=int(os.getenv("LOGIN_RATE_LIMIT", "10")),
+    window=int(os.getenv("LOGIN_RATE_WINDOW", "60")),
+)
+
+# Request metrics, served on /metrics
+metrics = Metrics(
+    slow_request_ms=float(os.environ["SLOW_REQUEST_MS"]) if os.getenv("SLOW_REQUEST_MS") else None,
+    snapshot_dir=os.getenv("METRICS_DIR"),
+)
+metrics.init_app(app, token=os.getenv("METRICS_TOKEN"))
+
+# Storage setup (Supabase by default, or a local SQLite file)
+storage = InstrumentedStorage(create_storage())
+
+# Per-user mood counts for the /my_moods charts, and decoded history for the trend series
+mood_cache_max_age = int(os.getenv("MOOD_ROLLUP_MAX_AGE", "300"))
+mood_rollup = MoodRollup(max_age=mood_cache_max_age)
+decoded_moods = DecodedMoodCache(max_age=mood_cache_max_age)
+
+def insert_moods(rows):
+    # Write every row of a submission in a single bulk insert
+    return storage.insert_moods(rows)
+
+# Opt-in write-behind queue for mood submissions
+mood_write_queue = None
+if os.getenv("MOOD_WRITE_BEHIND", "").lower() in ("1", "true", "yes"):
+    mood_write_queue = WriteBehindQueue(
+        insert_moods,
+        max_batch=int(os.getenv("MOOD_WRITE_BATCH", "500")),
+        max_delay=float(os.getenv("MOOD_WRITE_DELAY", "0.5")),
+        max_retries=int(os.getenv("MOOD_WRITE_RETRIES", "3")),
+    )
 
 # User class for Flask-Login
 class User(UserMixin):
@@ -32,17 +92,31 @@ class User(UserMixin):
         self.email = email
         self.username = username
 
-# gunicorn app:app --bind 0.0.0.0:$PORT
+# gunicorn app:app --bind 0.0.0.0:$PORT --threads 4
+# (threads let a worker keep serving while its requests wait on bcrypt)
+
+# Cache of loaded users so authenticated requests don't each query Supabase
+user_cache = UserCache(
+    max_size=int(os.getenv("USER_CACHE_SIZE", "1024")),
+    ttl=int(os.getenv("USER_CACHE_TTL", "300")),
+)
+metrics.gauges["mood_user_cache_hits"] = ("User loader cache hits", lambda: user_cache.stats()["hits"])
+metrics.gauges["mood_user_cache_misses"] = ("User loader cache misses", lambda: user_cache.stats()["misses"])
+metrics.gauges["mood_user_cache_size"] = ("Users held in the user loader cache", lambda: user_cache.stats()["size"])
 
 # Load user callback
 @login_manager.user_loader
 def load_user(user_id):
-    response = supabase.table("users").select("*").eq("id", user_id).execute()
-    if not response.data:
-        print(f"Error loading user: {response}")
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        return cached
+    user = storage.get_user(user_id)
+    if user is None:
+        print(f"Error loading user: {user_id}")
         return None
-    user = response.data[0]
-    return User(id=user["id"], email=user["email"], username=user.get("username"))
+    user_obj = User(id=user["id"], email=user["email"], username=user.get("username"))
+    user_cache.put(user_obj)
+    return user_obj
 
 # Routes
 @app.route("/")
@@ -62,22 +136,21 @@ def register():
             flash("Email, password, and username are required", "error")
             return redirect(url_for('register'))
         try:
-            existing_user = supabase.table("users").select("*").eq("username", username).execute()
-            existing_email = supabase.table("users").select("*").eq("email", email).execute()
-            if existing_user.data:
+            existing = storage.find_users(email, username)
+            if any(row["username"] == username for row in existing):
                 flash("Username already taken", "error")
                 return redirect(url_for('register'))
-            if existing_email.data:
+            if any(row["email"] == email for row in existing):
                 flash("Email already registered", "error")
                 return redirect(url_for('register'))
-            hashed_password = bcrypt.generate_password_hash(password).decode("utf-8")
-            response = supabase.table("users").insert({
-                "email": email,
-                "password": hashed_password,
-                "username": username
-            }).execute()
+            with phase("bcrypt"):
+                hashed_password = password_hasher.hash(password)
+            storage.create_user(email, hashed_password, username)
             flash("User registered successfully! You can now log in.", "success")
             return redirect(url_for('login'))
+        except HasherBusy:
+            flash("The server is busy, please try again in a moment.", "error")
+            return redirect(url_for('register'))
         except Exception as e:
             flash(f"Error inserting user: {str(e)}", "error")
             return redirect(url_for('register'))
@@ -93,14 +166,29 @@ def login():
         if not identifier or not password:
             flash("Email/Username and password are required", "error")
             return redirect(url_for('login'))
-        response = supabase.table("users").select("*").eq("email", identifier).execute()
-        if not response.data:
-            response = supabase.table("users").select("*").eq("username", identifier).execute()
-        user = response.data
-        if not user or not bcrypt.check_password_hash(user[0]["password"], password):
+        address_key, account_key = f"ip:{request.remote_addr}", f"id:{identifier.lower()}"
+        if not login_throttle.allow(address_key, account_key):
+            flash("Too many login attempts, please try again later.", "error")
+            return redirect(url_for('login'))
+        # Every attempt counts against the client address, but only failures count
+        # against the account, so someone else can't lock its owner out
+        login_throttle.record(address_key)
+        users = storage.find_users(identifier, identifier, with_password=True)
+        # Prefer an email match over a username match
+        users.sort(key=lambda row: row["email"] != identifier)
+        user = users[0] if users else None
+        try:
+            with phase("bcrypt"):
+                valid = user is not None and password_hasher.check(user["password"], password)
+        except HasherBusy:
+            flash("The server is busy, please try again in a moment.", "error")
+            return redirect(url_for('login'))
+        if not valid:
+            login_throttle.record(account_key)
             flash("Invalid email/username or password", "error")
             return redirect(url_for('login'))
-        user_obj = User(id=user[0]["id"], email=user[0]["email"], username=user[0]["username"])
+        user_obj = User(id=user["id"], email=user["email"], username=user["username"])
+        user_cache.put(user_obj)
         login_user(user_obj)
         flash("Login successful!", "success")
         return redirect(url_for('home'))
@@ -109,6 +197,7 @@ def login():
 @app.route("/logout")
 @login_required
 def logout():
+    user_cache.invalidate(current_user.id)
     logout_user()
     flash("You have been logged out successfully!", "success")
     return redirect(url_for('home'))
@@ -116,16 +205,8 @@ def logout():
 @app.route("/track_mood", methods=["GET", "POST"])
 @login_required
 def track_mood():
-    categorized_moods = {
-    "positive": ["Happy", "Joyful", "Grateful", "Excited", "Peaceful", "Relaxed", "Optimistic", "Satisfied", "Loving"],
-    "negative": ["Sad", "Angry", "Anxious", "Frustrated", "Overwhelmed", "Hopeless", "Tense", "Jealous", "Ashamed"],
-    "neutral": ["Calm", "Content", "Indifferent", "Tired", "Uninterested", "Neutral", "Curious", "Mellow", "Accepting"],
-    "high-energy": ["Energetic", "Productive", "Motivated", "Inspired", "Focused", "Determined", "Adventurous", "Cheerful", "Playful"],
-    "low-energy": ["Drained", "Defeated", "Exhausted", "Lonely", "Melancholic", "Isolated", "Sleepy", "Burned Out", "Withdrawn"],
-}
-    
     if request.method == "GET":
-        return render_template("track_mood.html", categorized_moods=categorized_moods)
+        return render_template("track_mood.html", categorized_moods=CATEGORIZED_MOODS)
     
     if request.method == "POST":
         moods = request.form.getlist("mood")  # Get multiple moods
@@ -135,87 +216,186 @@ def track_mood():
             flash("Please select at least one mood", "error")
             return redirect(url_for("track_mood"))
         
+        rows = [{"user_id": current_user.id, "mood": mood, "note": note} for mood in moods]
         try:
-            # Insert each selected mood into the database
-            for mood in moods:
-                response = supabase.table("moods").insert({
-                    "user_id": current_user.id,
-                    "mood": mood,
-                    "note": note
-                }).execute()
-                
-                # if response.error:
-                #     flash(f"Error tracking mood: {response.error.message}", "error")
-                #     return redirect(url_for("track_mood"))
-            
+            if mood_write_queue is None or not mood_write_queue.submit(rows):
+                insert_moods(rows)
+
             flash("Moods tracked successfully!", "success")
             return redirect(url_for("my_moods"))
         except Exception as e:
             flash(f"Error tracking mood: {str(e)}", "error")
             return redirect(url_for("track_mood"))
 
+# A year-long trend starts at local midnight a calendar year back, so keep a
+# little more than the rollup's year of decoded history
+DECODED_HISTORY = timedelta(seconds=RETENTION_SECONDS, days=2)
+
+def load_decoded_moods(user_id, last_write):
+    # Decoded history behind the rollups and trend series, cached until the
+    # user's newest row changes
+    def load():
+        return storage.moods_since(user_id, datetime.now(timezone.utc) - DECODED_HISTORY)
+    with phase("processing"):
+        return decoded_moods.get(user_id, last_write, load)
+
+def load_mood_counts(user_id):
+    # Serve from the rollup once it has caught up with the user's newest row.
+    # One indexed query tells us whether any worker has written since; if so,
+    # fold in only the newer rows, or rebuild when there's no rollup to extend.
+    last_write = storage.last_mood_at(user_id)
+    with phase("processing"):
+        counts = mood_rollup.counts(user_id, last_write)
+        if counts is not None:
+            return counts
+        loaded, rollup_write = mood_rollup.last_write(user_id)
+        if loaded and rollup_write is not None:
+            since = datetime.fromisoformat(rollup_write.replace("Z", "+00:00"))
+            newer = [
+                row for row in storage.moods_since(user_id, since)
+                if parse_timestamp(row["created_at"]) > parse_timestamp(rollup_write)
+            ]
+            if newer:
+                mood_rollup.apply(user_id, newer, rollup_write)
+                newest = max((row["created_at"] for row in newer), key=parse_timestamp)
+                counts = mood_rollup.counts(user_id, newest)
+        if counts is None:
+            decoded = load_decoded_moods(user_id, last_write)
+            mood_rollup.rebuild(user_id, decoded)
+            counts = mood_rollup.counts(user_id, decoded.last_created_at)
+    return counts
+
 @app.route("/my_moods")
 @login_required
 def my_moods():
     try:
-        # Fetch moods from Supabase
-        response = supabase.table("moods").select("*").eq("user_id", current_user.id).execute()
-        mood_rows = response.data  # Extract the rows
-
-        # Process and split combined moods
-        all_moods = []
-        for row in mood_rows:
-            if row["mood"] and row["created_at"]:  # Ensure mood and created_at are not None
-                # Split moods by comma and strip extra spaces
-                moods = [m.strip() for m in row["mood"].split(",")]
-                for mood in moods:
-                    all_moods.append({"mood": mood, "created_at": row["created_at"]})
-
-        return render_template("my_moods.html", all_moods=all_moods)
+        mood_counts = load_mood_counts(current_user.id)
+        return render_template("my_moods.html", mood_counts=mood_counts)
     except Exception as e:
         print("Error in my_moods route:", str(e))
         flash("Could not load mood data.", "error")
         return redirect(url_for("home"))
 
-def fetch_all_moods_from_supabase():
-    # Replace this with your actual Supabase fetching logic
-    return supabase.table('moods').select('*').execute().data
-
 @app.route("/mood_trend", methods=["GET"])
 @login_required
 def mood_trend():
     try:
-        # Fetch moods from Supabase
-        response = supabase.table("moods").select("*").eq("user_id", current_user.id).execute()
-        mood_rows = response.data
-
-        # Debugging: Print the fetched rows
-        # print("Mood rows fetched:", mood_rows)
+        # Only the moods to offer; the chart fetches its series from /api/moods/trend
+        year_counts = load_mood_counts(current_user.id)["year"]
 
         # Handle empty data
-        if not mood_rows:
+        if not year_counts:
             flash("No mood data available.", "warning")
-            return render_template("mood_trend.html", mood_data=[])
-
-        # Process data to group by mood and date
-        mood_data = []
-        for row in mood_rows:
-            if row["mood"] and row["created_at"]:  # Ensure mood and created_at are not None
-                moods = [m.strip() for m in row["mood"].split(",")]  # Handle combined mood entries
-                for mood in moods:
-                    mood_data.append({
-                        "mood": mood,
-                        "created_at": row["created_at"]
-                    })
-
-        # Debugging: Print the processed data
-        # print("Processed mood data:", mood_data)
-
-        return render_template("mood_trend.html", mood_data=mood_data)
+
+        mood_names = sorted(year_counts, key=mood_sort_key)
+        return render_template("mood_trend.html", mood_names=mood_names)
     except Exception as e:
         print("Error in mood_trend route:" + str(e))
         flash("Could not load mood data.", "error")
         return redirect(url_for("home"))
 
+# Mood history API
+MOOD_PAGE_SIZE = 100
+MAX_MOOD_PAGE_SIZE = 1000
+
+def encode_cursor(row):
+    raw = json.dumps([row["created_at"], row["id"]]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def decode_cursor(cursor):
+    created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    if not isinstance(created_at, str) or not isinstance(row_id, int) or isinstance(row_id, bool):
+        raise ValueError("malformed cursor")
+    datetime.fromisoformat(created_at.replace("Z", "+00:00"))
+    return created_at, row_id
+
+def parse_iso_arg(name):
+    value = request.args.get(name)
+    if value:
+        datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return value
+
+@app.route("/api/moods", methods=["GET"])
+@login_required
+def api_moods():
+    try:
+        limit = min(int(request.args.get("limit", MOOD_PAGE_SIZE)), MAX_MOOD_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError("limit must be positive")
+        since = parse_iso_arg("since")
+        until = parse_iso_arg("until")
+        cursor = request.args.get("cursor")
+        after = decode_cursor(cursor) if cursor else None
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid query parameter: {e}"}), 400
+    wanted = {m.strip() for m in request.args.getlist("mood") if m.strip()}
+
+    # Newest first, keyset-paginated on (created_at, id); mood names are
+    # matched as substrings by storage and checked exactly below
+    try:
+        rows = storage.list_moods(
+            current_user.id, limit + 1, since=since, until=until, moods=sorted(wanted), after=after
+        )
+    except Exception as e:
+        print("Error in api_moods route:", str(e))
+        return jsonify({"error": "Could not load mood data."}), 500
+
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    rows = rows[:limit]
+    if wanted:
+        rows = [row for row in rows if wanted.intersection(split_moods(row["mood"]))]
+
+    def generate():
+        yield '{"moods": ['
+        for i, row in enumerate(rows):
+            yield ("," if i else "") + json.dumps(row)
+        yield "], " + json.dumps({"next_cursor": next_cursor})[1:]
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
+@app.route("/api/moods/trend", methods=["GET"])
+@login_required
+def api_mood_trend():
+    mood = (request.args.get("mood") or "").strip()
+    frame = request.args.get("frame", "week")
+    tz_name = request.args.get("tz") or "UTC"
+    if not mood:
+        return jsonify({"error": "mood is required"}), 400
+    if frame not in TREND_FRAMES:
+        return jsonify({"error": f"frame must be one of {', '.join(TREND_FRAMES)}"}), 400
+    try:
+        tz = ZoneInfo(tz_name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return jsonify({"error": f"Unknown time zone {tz_name!r}"}), 400
+
+    now = datetime.now(tz)
+    start = trend_start(frame, now)
+    try:
+        # The series only changes when the user writes or the frame's start moves
+        last_write = storage.last_mood_at(current_user.id)
+        etag = hashlib.sha1(
+            json.dumps([current_user.id, last_write, mood, frame, tz_name, start.isoformat()]).encode("utf-8")
+        ).hexdigest()
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            decoded = load_decoded_moods(current_user.id, last_write)
+            with phase("processing"):
+                series = trend_series(decoded, mood, frame, now)
+            response = jsonify({
+                "mood": mood,
+                "frame": frame,
+                "tz": tz_name,
+                "start": start.isoformat(),
+                "series": series,
+            })
+    except Exception as e:
+        print("Error in api_mood_trend route:", str(e))
+        return jsonify({"error": "Could not load mood data."}), 500
+
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
 if __name__ == "__main__":
     app.run(debug=True)
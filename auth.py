@@ -0,0 +1,81 @@
+"""Password hashing off the request thread and login rate limiting."""
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+
+class HasherBusy(Exception):
+    """Raised when no bcrypt slot frees up within the wait timeout."""
+
+
+class PasswordHasher:
+    """Runs Flask-Bcrypt hashing and verification in a bounded thread pool.
+
+    At most ``max_pending`` operations may be running or queued at once;
+    callers beyond that wait up to ``wait_timeout`` seconds for a slot and then
+    get ``HasherBusy`` instead of piling more CPU work onto the worker.
+
+    The calling thread still blocks until its hash is done. The pool only
+    bounds how much bcrypt CPU a worker burns at once; to keep serving other
+    requests meanwhile, run gunicorn with threads (``--threads N``).
+    """
+
+    def __init__(self, bcrypt, workers=2, max_pending=8, wait_timeout=5.0):
+        self.bcrypt = bcrypt
+        self.wait_timeout = wait_timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            raise HasherBusy()
+        try:
+            return self._pool.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(self.bcrypt.generate_password_hash, password).decode("utf-8")
+
+    def check(self, pw_hash, password):
+        return self._run(self.bcrypt.check_password_hash, pw_hash, password)
+
+
+class LoginThrottle:
+    """Sliding-window limit on login attempts per key (client address, identifier).
+
+    ``allow()`` checks the keys before an attempt; ``record()`` counts the
+    attempt against whichever keys it should count for.
+    """
+
+    def __init__(self, max_attempts=10, window=60, max_keys=10000):
+        self.max_attempts = max_attempts
+        self.window = window
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._attempts = OrderedDict()  # key -> list of attempt times
+
+    def _recent(self, key, now):
+        # Attempts still inside the window; caller holds the lock
+        cutoff = now - self.window
+        attempts = [t for t in self._attempts.get(key, ()) if t > cutoff]
+        self._attempts[key] = attempts
+        self._attempts.move_to_end(key)
+        while len(self._attempts) > self.max_keys:
+            self._attempts.popitem(last=False)
+        return attempts
+
+    def allow(self, *keys):
+        """False if any key already has ``max_attempts`` in the window."""
+        now = time.monotonic()
+        with self._lock:
+            return all(len(self._recent(key, now)) < self.max_attempts for key in keys if key)
+
+    def record(self, *keys):
+        """Count one attempt against each key."""
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                if key:
+                    self._recent(key, now).append(now)
@@ -0,0 +1,58 @@
+"""Synthetic users and mood histories for the benchmarks.
+
+Everything goes into a SQLite database created with the app's own schema, so
+the app can be pointed at it with ``STORAGE_BACKEND=sqlite``.
+"""
+from datetime import datetime, timedelta, timezone
+import random
+
+import bcrypt
+
+from mood_codec import CATEGORIZED_MOODS
+from storage import SQLiteStorage, sqlite_timestamp
+
+PASSWORD = "benchmark-password"
+ALL_MOODS = [name for names in CATEGORIZED_MOODS.values() for name in names]
+
+
+def bench_username(history_size):
+    return f"bench{history_size}"
+
+
+def mood_rows(user_id, count, days, rng, now):
+    # Mostly single moods, some comma-joined like the bubble form submits
+    span = days * 86400
+    for _ in range(count):
+        picks = rng.sample(ALL_MOODS, 1 if rng.random() < 0.7 else rng.randint(2, 4))
+        created_at = now - timedelta(seconds=rng.uniform(0, span))
+        yield (user_id, ",".join(picks), "", sqlite_timestamp(created_at))
+
+
+def build_database(path, history_sizes, days=730, bcrypt_rounds=12, seed=1234, batch_size=50000):
+    """Create one user per history size and fill in their moods.
+
+    Returns ``{history_size: {"id", "username", "email", "password"}}``.
+    """
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    storage = SQLiteStorage(path)
+    password_hash = bcrypt.hashpw(PASSWORD.encode("utf-8"), bcrypt.gensalt(bcrypt_rounds)).decode("utf-8")
+
+    users = {}
+    for size in history_sizes:
+        username = bench_username(size)
+        email = f"{username}@example.com"
+        user = storage.create_user(email, password_hash, username)
+        users[size] = {"id": user["id"], "username": username, "email": email, "password": PASSWORD}
+
+        rows = mood_rows(user["id"], size, days, rng, now)
+        conn = storage._connection()
+        while True:
+            batch = [row for _, row in zip(range(batch_size), rows)]
+            if not batch:
+                break
+            with conn:
+                conn.executemany(
+                    "INSERT INTO moods (user_id, mood, note, created_at) VALUES (?, ?, ?, ?)", batch
+                )
+    return users
@@ -0,0 +1,342 @@
+"""Benchmark the app's routes against synthetic users on a local SQLite database.
+
+Examples (from the repository root):
+
+    python -m benchmarks.run --sizes 10,10000
+    python -m benchmarks.run --sizes 10,10000,1000000 --mode both --workers 4
+    python -m benchmarks.run --baseline old.json --output new.json
+
+Each route is driven through the Flask test client (``client`` mode) and/or
+over HTTP against ``gunicorn`` workers (``gunicorn`` mode). Throughput,
+latency percentiles, response size and peak memory per route are written as
+JSON so runs can be compared with ``--baseline``. Peak memory is the
+tracemalloc peak of one extra request in client mode, and the largest
+worker peak RSS so far in gunicorn mode.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import http.client
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from urllib.parse import urlencode
+
+from benchmarks.fixtures import PASSWORD, bench_username, build_database
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROUTES = ["/login", "/track_mood", "/my_moods", "/mood_trend", "/api/moods/trend?mood=Happy&frame=year"]
+
+
+def app_env(db_path, bcrypt_rounds):
+    return {
+        "STORAGE_BACKEND": "sqlite",
+        "SQLITE_PATH": db_path,
+        "BCRYPT_LOG_ROUNDS": str(bcrypt_rounds),
+        # Benchmarks log in far more often than any real client would
+        "LOGIN_RATE_LIMIT": "1000000000",
+    }
+
+
+def request_args(route, user):
+    """(method, form data) for one request to ``route``."""
+    if route == "/login":
+        return "POST", {"username": user["username"], "password": user["password"]}
+    if route == "/track_mood":
+        return "POST", {"mood": "Happy,Calm", "note": "benchmark"}
+    return "GET", None
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def summarize(mode, size, route, concurrency, timings, sizes, errors, elapsed, peak_memory):
+    latencies = [t * 1000 for t in timings]
+    return {
+        "mode": mode,
+        "history_size": size,
+        "route": route,
+        "requests": len(timings),
+        "concurrency": concurrency,
+        "errors": errors,
+        "throughput_rps": round(len(timings) / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "first": round(latencies[0], 3) if latencies else None,
+            "mean": round(sum(latencies) / len(latencies), 3) if latencies else None,
+            "p50": round(percentile(latencies, 50), 3) if latencies else None,
+            "p95": round(percentile(latencies, 95), 3) if latencies else None,
+            "p99": round(percentile(latencies, 99), 3) if latencies else None,
+            "max": round(max(latencies), 3) if latencies else None,
+        },
+        "response_bytes": {
+            "mean": round(sum(sizes) / len(sizes)) if sizes else None,
+            "max": max(sizes) if sizes else None,
+        },
+        "peak_memory_bytes": peak_memory,
+    }
+
+
+def drive(route, user, requests, concurrency, new_session, send):
+    """Issue ``requests`` calls split across ``concurrency`` threads.
+
+    ``new_session(login)`` returns a per-thread session; ``send(session,
+    method, route, data)`` returns ``(status, body_bytes)``.
+    """
+    method, data = request_args(route, user)
+    per_thread = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+    timings, sizes, errors = [], [], [0]
+    lock = threading.Lock()
+
+    def worker(count):
+        # /login must start logged out, every other route starts logged in
+        session = None if route == "/login" else new_session(True)
+        for _ in range(count):
+            if route == "/login":
+                session = new_session(False)
+            start = time.perf_counter()
+            status, body = send(session, method, route, data)
+            took = time.perf_counter() - start
+            with lock:
+                timings.append(took)
+                sizes.append(len(body))
+                if status >= 400:
+                    errors[0] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, [n for n in per_thread if n]))
+    return timings, sizes, errors[0], time.perf_counter() - start
+
+
+def run_client(users, args, db_path):
+    os.environ.update(app_env(db_path, args.bcrypt_rounds))
+    sys.path.insert(0, ROOT)
+    import app as app_module
+
+    flask_app = app_module.app
+    results = []
+    for size, user in users.items():
+        def new_session(login):
+            client = flask_app.test_client()
+            if login:
+                client.post("/login", data={"username": user["username"], "password": user["password"]})
+            return client
+
+        def send(client, method, route, data):
+            response = client.open(route, method=method, data=data)
+            return response.status_code, response.get_data()
+
+        for route in ROUTES:
+            timings, sizes, errors, elapsed = drive(
+                route, user, args.requests, args.concurrency, new_session, send
+            )
+            # Separate single request under tracemalloc so it doesn't skew timings
+            client = new_session(route != "/login")
+            method, data = request_args(route, user)
+            tracemalloc.start()
+            send(client, method, route, data)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results.append(summarize("client", size, route, args.concurrency, timings, sizes, errors, elapsed, peak))
+            print_result(results[-1])
+    return results
+
+
+class HttpSession:
+    """Minimal cookie-keeping HTTP client that doesn't follow redirects."""
+
+    def __init__(self, port):
+        self.port = port
+        self.cookies = {}
+
+    def request(self, method, route, data=None):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=120)
+        headers = {}
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        if self.cookies:
+            headers["Cookie"] = "; ".join(f"{k}={v}" for k, v in self.cookies.items())
+        try:
+            conn.request(method, route, body=body, headers=headers)
+            response = conn.getresponse()
+            payload = response.read()
+            for header in response.msg.get_all("Set-Cookie") or []:
+                name, _, rest = header.partition("=")
+                self.cookies[name.strip()] = rest.split(";", 1)[0]
+            return response.status, payload
+        finally:
+            conn.close()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def worker_peak_rss(master_pid):
+    """Largest VmHWM (peak RSS) across gunicorn workers, Linux only."""
+    peak = None
+    try:
+        with open(f"/proc/{master_pid}/task/{master_pid}/children") as f:
+            pids = f.read().split()
+        for pid in pids:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        rss = int(line.split()[1]) * 1024
+                        peak = rss if peak is None else max(peak, rss)
+    except OSError:
+        return None
+    return peak
+
+
+def run_gunicorn(users, args, db_path):
+    port = free_port()
+    env = dict(os.environ, **app_env(db_path, args.bcrypt_rounds))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "app:app", "--bind", f"127.0.0.1:{port}",
+         "--workers", str(args.workers), "--threads", str(args.threads), "--log-level", "warning"],
+        cwd=ROOT, env=env,
+    )
+    results = []
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                HttpSession(port).request("GET", "/")
+                break
+            except OSError:
+                if time.monotonic() > deadline or process.poll() is not None:
+                    raise RuntimeError("gunicorn did not start")
+                time.sleep(0.2)
+
+        for size, user in users.items():
+            def new_session(login):
+                session = HttpSession(port)
+                if login:
+                    session.request("POST", "/login", {"username": user["username"], "password": user["password"]})
+                return session
+
+            def send(session, method, route, data):
+                return session.request(method, route, data)
+
+            for route in ROUTES:
+                timings, sizes, errors, elapsed = drive(
+                    route, user, args.requests, args.concurrency, new_session, send
+                )
+                peak = worker_peak_rss(process.pid)
+                results.append(summarize("gunicorn", size, route, args.concurrency, timings, sizes, errors, elapsed, peak))
+                print_result(results[-1])
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    return results
+
+
+def print_result(result):
+    latency = result["latency_ms"]
+    print(
+        f"{result['mode']:8} {result['history_size']:>9} {result['route']:12} "
+        f"{result['throughput_rps']:>9} req/s  p50 {latency['p50']:>9} ms  p95 {latency['p95']:>9} ms  "
+        f"p99 {latency['p99']:>9} ms  {result['response_bytes']['mean']:>9} B  "
+        f"errors {result['errors']}"
+    )
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {
+            (r["mode"], r["history_size"], r["route"]): r for r in json.load(f)["results"]
+        }
+    print(f"\nCompared with {baseline_path} (new / old):")
+    for result in results:
+        old = baseline.get((result["mode"], result["history_size"], result["route"]))
+        if old is None:
+            continue
+        ratios = []
+        for label, new_value, old_value in [
+            ("p95", result["latency_ms"]["p95"], old["latency_ms"]["p95"]),
+            ("throughput", result["throughput_rps"], old["throughput_rps"]),
+            ("size", result["response_bytes"]["mean"], old["response_bytes"]["mean"]),
+        ]:
+            ratio = f"x{new_value / old_value:.2f}" if new_value and old_value else "n/a"
+            ratios.append(f"{label} {ratio}")
+        print(f"{result['mode']:8} {result['history_size']:>9} {result['route']:12} " + "  ".join(ratios))
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10,10000", help="comma-separated mood history sizes, one user each")
+    parser.add_argument("--mode", choices=["client", "gunicorn", "both"], default="client")
+    parser.add_argument("--requests", type=int, default=200, help="requests per route and history size")
+    parser.add_argument("--concurrency", type=int, default=4, help="concurrent clients per route")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn workers")
+    parser.add_argument("--threads", type=int, default=1, help="gunicorn threads per worker")
+    parser.add_argument("--bcrypt-rounds", type=int, default=12, help="bcrypt cost for the synthetic users")
+    parser.add_argument("--days", type=int, default=730, help="spread histories over this many days")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--db", help="reuse or create the SQLite database at this path")
+    parser.add_argument("--output", default="bench_results.json", help="where to write JSON results")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="mood-bench-"), "bench.db")
+    if args.db and os.path.exists(args.db):
+        print(f"Reusing {args.db}; make sure it was built with the same --sizes")
+        users = {
+            size: {"username": bench_username(size), "password": PASSWORD} for size in sizes
+        }
+    else:
+        print(f"Building {db_path} with histories of {sizes} moods...")
+        users = build_database(db_path, sizes, days=args.days, bcrypt_rounds=args.bcrypt_rounds, seed=args.seed)
+
+    results = []
+    if args.mode in ("gunicorn", "both"):
+        results += run_gunicorn(users, args, db_path)
+    if args.mode in ("client", "both"):
+        results += run_client(users, args, db_path)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {args.output}")
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
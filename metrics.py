@@ -0,0 +1,349 @@
+"""Per-request instrumentation and a Prometheus-style /metrics endpoint.
+
+Every request records its latency and response size per route, plus how long
+it spent in each phase: ``storage`` calls, ``bcrypt``, ``processing`` (mood
+decoding and rollups), ``render`` (Jinja) and ``other``.  Phases nest, and
+time is only ever charged to the innermost one.
+
+Each gunicorn worker keeps its own counters; with ``METRICS_DIR`` set they
+periodically write a snapshot there and ``/metrics`` merges all of them,
+deleting snapshots left behind by workers that have exited.
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+
+from flask import Response, g, has_request_context, request, template_rendered, before_render_template
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+class RequestTimer:
+    """Splits one request's wall time across (possibly nested) phases."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = defaultdict(float)
+        self.storage_calls = defaultdict(int)
+        self._stack = ["other"]
+        self._mark = self.started
+
+    def enter(self, name):
+        now = time.perf_counter()
+        self.phases[self._stack[-1]] += now - self._mark
+        self._stack.append(name)
+        self._mark = now
+
+    def exit(self):
+        now = time.perf_counter()
+        self.phases[self._stack.pop()] += now - self._mark
+        self._mark = now
+
+    def finish(self):
+        now = time.perf_counter()
+        self.phases[self._stack[-1]] += now - self._mark
+        self._mark = now
+        return now - self.started
+
+
+def current_timer():
+    if has_request_context():
+        return g.get("request_timer")
+    return None
+
+
+@contextmanager
+def phase(name):
+    """Charge the enclosed time to ``name`` for the current request, if any."""
+    timer = current_timer()
+    if timer is None:
+        yield
+        return
+    timer.enter(name)
+    try:
+        yield
+    finally:
+        timer.exit()
+
+
+class InstrumentedStorage:
+    """Wraps a Storage so each call is counted and timed as ``storage``."""
+
+    def __init__(self, storage):
+        self._storage = storage
+
+    def __getattr__(self, name):
+        attr = getattr(self._storage, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            timer = current_timer()
+            if timer is None:
+                return attr(*args, **kwargs)
+            timer.storage_calls[name] += 1
+            with phase("storage"):
+                return attr(*args, **kwargs)
+        return call
+
+
+class _CountingBody:
+    """Passes a streamed response body through, reporting its size once sent."""
+
+    def __init__(self, body, on_close):
+        self._body = body
+        self._on_close = on_close
+        self._size = 0
+        self._closed = False
+
+    def __iter__(self):
+        for chunk in self._body:
+            self._size += len(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+            yield chunk
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            if hasattr(self._body, "close"):
+                self._body.close()
+        finally:
+            self._on_close(self._size)
+
+
+def _new_histogram(buckets):
+    return {"buckets": [0] * (len(buckets) + 1), "sum": 0.0, "count": 0}
+
+
+def _observe(histogram, bounds, value):
+    for i, bound in enumerate(bounds):
+        if value <= bound:
+            histogram["buckets"][i] += 1
+            break
+    else:
+        histogram["buckets"][-1] += 1
+    histogram["sum"] += value
+    histogram["count"] += 1
+
+
+class Metrics:
+    def __init__(self, slow_request_ms=None, snapshot_dir=None, snapshot_interval=5.0):
+        self.slow_request_ms = slow_request_ms
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_interval = snapshot_interval
+        self.gauges = {}  # name -> (help text, callable returning a number)
+        self._lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        # Part of the snapshot name, so a worker that reuses an old pid
+        # doesn't overwrite that worker's file
+        self._started = time.time_ns()
+        self._last_snapshot = 0.0
+        self.latency = {}  # (route, method, status) -> histogram
+        self.sizes = {}  # route -> histogram
+        self.phases = defaultdict(float)  # (route, phase) -> seconds
+        self.storage_calls = defaultdict(int)  # (route, operation) -> calls
+
+    def record(self, route, method, status, timer, size):
+        duration = timer.finish()
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked from a preloaded master; don't inherit its counts
+                self._reset()
+            key = (route, method, str(status))
+            _observe(self.latency.setdefault(key, _new_histogram(LATENCY_BUCKETS)), LATENCY_BUCKETS, duration)
+            if size is not None:
+                _observe(self.sizes.setdefault(route, _new_histogram(SIZE_BUCKETS)), SIZE_BUCKETS, size)
+            for name, seconds in timer.phases.items():
+                self.phases[(route, name)] += seconds
+            for operation, calls in timer.storage_calls.items():
+                self.storage_calls[(route, operation)] += calls
+            write_snapshot = (
+                self.snapshot_dir and time.monotonic() - self._last_snapshot > self.snapshot_interval
+            )
+            if write_snapshot:
+                # Claim this interval so concurrent requests don't all write
+                self._last_snapshot = time.monotonic()
+        if self.slow_request_ms is not None and duration * 1000 >= self.slow_request_ms:
+            breakdown = ", ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in sorted(timer.phases.items()))
+            calls = sum(timer.storage_calls.values())
+            print(f"Slow request: {method} {route} {status} took {duration * 1000:.1f}ms "
+                  f"({breakdown}; {calls} storage calls)")
+        if write_snapshot:
+            self.write_snapshot()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "latency": [[list(k), v["buckets"][:], v["sum"], v["count"]] for k, v in self.latency.items()],
+                "sizes": [[k, v["buckets"][:], v["sum"], v["count"]] for k, v in self.sizes.items()],
+                "phases": [[list(k), v] for k, v in self.phases.items()],
+                "storage_calls": [[list(k), v] for k, v in self.storage_calls.items()],
+            }
+
+    def write_snapshot(self):
+        """Write this worker's snapshot; failures are logged, never raised."""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            self._last_snapshot = time.monotonic()
+            path = os.path.join(self.snapshot_dir, f"metrics-{self._pid}-{self._started}.json")
+        with self._snapshot_lock:
+            tmp_path = None
+            try:
+                fd, tmp_path = tempfile.mkstemp(dir=self.snapshot_dir, prefix=".metrics-", suffix=".tmp")
+                with os.fdopen(fd, "w") as f:
+                    json.dump(self.snapshot(), f)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"Error writing metrics snapshot to {self.snapshot_dir}: {e}")
+                if tmp_path is not None and os.path.exists(tmp_path):
+                    try:
+                        os.remove(tmp_path)
+                    except OSError:
+                        pass
+
+    def collect(self):
+        """This worker's snapshot merged with every other worker's on disk."""
+        if not self.snapshot_dir:
+            return [self.snapshot()]
+        self.write_snapshot()
+        snapshots = []
+        for path in glob.glob(os.path.join(self.snapshot_dir, "metrics-*.json")):
+            if not _pid_alive(_snapshot_pid(path)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self):
+        latency = defaultdict(lambda: _new_histogram(LATENCY_BUCKETS))
+        sizes = defaultdict(lambda: _new_histogram(SIZE_BUCKETS))
+        phases = defaultdict(float)
+        storage_calls = defaultdict(int)
+        for snap in self.collect():
+            for groups, merged in ((snap["latency"], latency), (snap["sizes"], sizes)):
+                for key, buckets, total, count in groups:
+                    target = merged[tuple(key) if isinstance(key, list) else key]
+                    target["buckets"] = [a + b for a, b in zip(target["buckets"], buckets)]
+                    target["sum"] += total
+                    target["count"] += count
+            for key, seconds in snap["phases"]:
+                phases[tuple(key)] += seconds
+            for key, calls in snap["storage_calls"]:
+                storage_calls[tuple(key)] += calls
+
+        lines = []
+        lines += _histogram_lines(
+            "mood_http_request_duration_seconds", "Request latency by route.",
+            LATENCY_BUCKETS, {(("route", r), ("method", m), ("status", s)): h for (r, m, s), h in latency.items()},
+        )
+        lines += _histogram_lines(
+            "mood_http_response_size_bytes", "Response body size by route.",
+            SIZE_BUCKETS, {(("route", r),): h for r, h in sizes.items()},
+        )
+        lines += ["# HELP mood_request_phase_seconds_total Time spent per request phase.",
+                  "# TYPE mood_request_phase_seconds_total counter"]
+        for (route, name), seconds in sorted(phases.items()):
+            lines.append(f"mood_request_phase_seconds_total{_labels((('route', route), ('phase', name)))} {seconds}")
+        lines += ["# HELP mood_storage_calls_total Storage calls by route and operation.",
+                  "# TYPE mood_storage_calls_total counter"]
+        for (route, operation), calls in sorted(storage_calls.items()):
+            lines.append(f"mood_storage_calls_total{_labels((('route', route), ('operation', operation)))} {calls}")
+        for name, (help_text, read) in sorted(self.gauges.items()):
+            lines += [f"# HELP {name} {help_text} (this worker).", f"# TYPE {name} gauge"]
+            lines.append(f"{name} {read()}")
+        return "\n".join(lines) + "\n"
+
+    def init_app(self, app, endpoint="/metrics", token=None):
+        @app.before_request
+        def start_timer():
+            g.request_timer = RequestTimer()
+
+        @app.after_request
+        def record_request(response):
+            timer = g.pop("request_timer", None)
+            if timer is not None:
+                route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+                method, status = request.method, response.status_code
+                if response.is_streamed:
+                    # Size is only known once the body has been sent; record then
+                    response.response = _CountingBody(
+                        response.response, lambda size: self.record(route, method, status, timer, size)
+                    )
+                else:
+                    self.record(route, method, status, timer, response.calculate_content_length())
+            return response
+
+        def render_started(sender, template, context, **extra):
+            timer = current_timer()
+            if timer is not None:
+                timer.enter("render")
+
+        def render_finished(sender, template, context, **extra):
+            timer = current_timer()
+            if timer is not None:
+                timer.exit()
+
+        before_render_template.connect(render_started, app, weak=False)
+        template_rendered.connect(render_finished, app, weak=False)
+
+        @app.route(endpoint)
+        def metrics_endpoint():
+            if token and request.headers.get("Authorization") != f"Bearer {token}":
+                return Response("Unauthorized\n", status=401, mimetype="text/plain")
+            return Response(self.render(), mimetype="text/plain; version=0.0.4")
+
+
+def _snapshot_pid(path):
+    try:
+        return int(os.path.basename(path).split("-")[1].split(".")[0])
+    except (IndexError, ValueError):
+        return None
+
+
+def _pid_alive(pid):
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _labels(pairs):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in pairs) + "}"
+
+
+def _histogram_lines(name, help_text, bounds, series):
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for labels, histogram in sorted(series.items()):
+        cumulative = 0
+        for bound, count in zip(list(bounds) + ["+Inf"], histogram["buckets"]):
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+        lines.append(f"{name}_sum{_labels(labels)} {histogram['sum']}")
+        lines.append(f"{name}_count{_labels(labels)} {histogram['count']}")
+    return lines
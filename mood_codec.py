@@ -0,0 +1,218 @@
+"""Compact columnar decoding of mood rows, shared by the mood pages.
+
+Raw ``moods`` rows hold comma-joined names and ISO timestamps.  They are
+decoded once into parallel arrays of epoch seconds and small integer mood
+ids, sorted by time, and cached per user until the user's newest
+``created_at`` changes.
+"""
+from array import array
+from bisect import bisect_left
+from calendar import monthrange
+from collections import OrderedDict
+from datetime import datetime, time as dt_time, timedelta, timezone
+import threading
+import time
+
+# Mood choices offered on /track_mood, grouped by bubble colour
+CATEGORIZED_MOODS = {
+    "positive": ["Happy", "Joyful", "Grateful", "Excited", "Peaceful", "Relaxed", "Optimistic", "Satisfied", "Loving"],
+    "negative": ["Sad", "Angry", "Anxious", "Frustrated", "Overwhelmed", "Hopeless", "Tense", "Jealous", "Ashamed"],
+    "neutral": ["Calm", "Content", "Indifferent", "Tired", "Uninterested", "Neutral", "Curious", "Mellow", "Accepting"],
+    "high-energy": ["Energetic", "Productive", "Motivated", "Inspired", "Focused", "Determined", "Adventurous", "Cheerful", "Playful"],
+    "low-energy": ["Drained", "Defeated", "Exhausted", "Lonely", "Melancholic", "Isolated", "Sleepy", "Burned Out", "Withdrawn"],
+}
+
+
+def parse_timestamp(value):
+    """Return epoch seconds for a Supabase ``created_at`` value (naive = UTC)."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def split_moods(value):
+    """Split a comma-joined ``mood`` column into individual mood names."""
+    if not value:
+        return []
+    return [m.strip() for m in value.split(",") if m.strip()]
+
+
+class MoodVocabulary:
+    """Mapping between mood names and small integer ids.
+
+    The shared ``vocabulary`` holds only ``CATEGORIZED_MOODS`` and never
+    changes. Each decode works on an ``extend()``-ed copy that gives any other
+    names local ids, so user-supplied strings don't pile up in process memory.
+    """
+
+    def __init__(self, names=()):
+        self._ids = {}
+        self.names = []
+        for name in names:
+            self.id_for(name)
+
+    def id_for(self, name):
+        mood_id = self._ids.get(name)
+        if mood_id is None:
+            mood_id = len(self.names)
+            self.names.append(name)
+            self._ids[name] = mood_id
+        return mood_id
+
+    def get(self, name):
+        return self._ids.get(name)
+
+    def extend(self):
+        """A private copy that can take new names without touching this one."""
+        return MoodVocabulary(self.names)
+
+
+vocabulary = MoodVocabulary(
+    name for category in CATEGORIZED_MOODS.values() for name in category
+)
+
+
+def mood_sort_key(name):
+    """Order moods as on /track_mood, with any other names after them."""
+    mood_id = vocabulary.get(name)
+    return (mood_id is None, mood_id or 0, name)
+
+
+class DecodedMoods:
+    """One entry per individual mood: parallel ``times`` and ``ids`` arrays.
+
+    ``ids`` index into this decode's own ``vocabulary``; ``last_created_at``
+    is the raw ``created_at`` of the newest row decoded.
+    """
+
+    __slots__ = ("times", "ids", "vocabulary", "last_created_at")
+
+    def __init__(self, times=None, ids=None, vocabulary=vocabulary, last_created_at=None):
+        self.times = times if times is not None else array("q")
+        self.ids = ids if ids is not None else array("I")
+        self.vocabulary = vocabulary
+        self.last_created_at = last_created_at
+
+    @classmethod
+    def from_rows(cls, rows):
+        local = vocabulary.extend()
+        times, ids = array("q"), array("I")
+        last_created_at, last_ts = None, None
+        for row in rows:
+            created_at = row.get("created_at")
+            if not created_at:
+                continue
+            exact = parse_timestamp(created_at)
+            if last_ts is None or exact > last_ts:
+                last_created_at, last_ts = created_at, exact
+            ts = int(exact)
+            for name in split_moods(row.get("mood")):
+                times.append(ts)
+                ids.append(local.id_for(name))
+        if any(times[i] > times[i + 1] for i in range(len(times) - 1)):
+            order = sorted(range(len(times)), key=times.__getitem__)
+            times, ids = array("q", (times[i] for i in order)), array("I", (ids[i] for i in order))
+        return cls(times, ids, local, last_created_at)
+
+    def __len__(self):
+        return len(self.times)
+
+    def start_index(self, since):
+        return bisect_left(self.times, since)
+
+    def times_for(self, mood):
+        """Sorted epoch seconds of every entry of one mood."""
+        mood_id = self.vocabulary.get(mood)
+        if mood_id is None:
+            return array("q")
+        return array("q", (t for t, i in zip(self.times, self.ids) if i == mood_id))
+
+
+# Time frames offered by the /mood_trend dropdown
+TREND_FRAMES = ("day", "week", "month", "year")
+
+
+def trend_start(frame, now):
+    """Start of the ``frame`` ending at tz-aware ``now``, on a bucket boundary."""
+    if frame == "day":
+        start = now - timedelta(days=1)
+        return start.replace(minute=0, second=0, microsecond=0)
+    if frame == "week":
+        start = now - timedelta(days=7)
+    elif frame == "month":
+        year, month = (now.year, now.month - 1) if now.month > 1 else (now.year - 1, 12)
+        start = now.replace(year=year, month=month, day=min(now.day, monthrange(year, month)[1]))
+    else:
+        day = min(now.day, monthrange(now.year - 1, now.month)[1])
+        start = now.replace(year=now.year - 1, day=day)
+    return datetime.combine(start.date(), dt_time(0), tzinfo=now.tzinfo)
+
+
+def trend_buckets(frame, start, now):
+    """Bucket start times from ``start`` to ``now``: hourly for a day, else daily."""
+    buckets = []
+    if frame == "day":
+        current = start.astimezone(timezone.utc)
+        while current <= now:
+            buckets.append(current.astimezone(start.tzinfo))
+            current += timedelta(hours=1)
+    else:
+        day = start.date()
+        while day <= now.date():
+            buckets.append(datetime.combine(day, dt_time(0), tzinfo=start.tzinfo))
+            day += timedelta(days=1)
+    return buckets
+
+
+def trend_series(decoded, mood, frame, now):
+    """``[(bucket label, count)]`` for one mood over ``frame``, skipping empty buckets.
+
+    Buckets follow ``now``'s time zone, so days start at local midnight.
+    """
+    times = decoded.times_for(mood)
+    buckets = trend_buckets(frame, trend_start(frame, now), now)
+    edges = [int(b.timestamp()) for b in buckets] + [int(now.timestamp()) + 1]
+    label_format = "%Y-%m-%dT%H:00" if frame == "day" else "%Y-%m-%d"
+    series = []
+    for bucket, low, high in zip(buckets, edges, edges[1:]):
+        count = bisect_left(times, high) - bisect_left(times, low)
+        if count:
+            series.append((bucket.strftime(label_format), count))
+    return series
+
+
+class DecodedMoodCache:
+    """Per-user DecodedMoods, keyed by the user's newest ``created_at``.
+
+    Callers pass ``Storage.last_mood_at()`` as ``last_write``, so a write from
+    any gunicorn worker makes the cached entry miss. Entries also expire after
+    ``max_age`` seconds.
+    """
+
+    def __init__(self, max_age=300, max_users=1024):
+        self.max_age = max_age
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # user id -> (last_write, loaded_at, DecodedMoods)
+
+    def get(self, user_id, last_write, load):
+        """Return the cached DecodedMoods, calling ``load()`` for rows on a miss."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] == last_write and now - entry[1] <= self.max_age:
+                self._entries.move_to_end(user_id)
+                return entry[2]
+        decoded = DecodedMoods.from_rows(load())
+        with self._lock:
+            self._entries[user_id] = (last_write, now, decoded)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+        return decoded
@@ -0,0 +1,146 @@
+"""Per-user mood count rollups backing the /my_moods pie charts.
+
+Counts are kept in hourly buckets per user so the day/week/month/year windows
+can be answered without touching the raw ``moods`` history.  Each rollup
+remembers the newest ``created_at`` it has counted; callers compare that with
+``Storage.last_mood_at()`` and fold in just the newer rows when it has moved,
+so writes from any gunicorn worker show up on the next view.  A rollup is
+rebuilt from decoded history the first time it's needed and again after
+``max_age`` seconds.
+"""
+from collections import Counter, OrderedDict
+from itertools import groupby
+import threading
+import time
+
+from mood_codec import parse_timestamp, split_moods
+
+# Rolling windows shown on /my_moods, in days
+WINDOWS = {"day": 1, "week": 7, "month": 30, "year": 365}
+
+BUCKET_SECONDS = 3600
+RETENTION_SECONDS = max(WINDOWS.values()) * 86400
+
+
+class _UserRollup:
+    __slots__ = ("buckets", "built_at", "last_write", "totals", "totals_hour")
+
+    def __init__(self, built_at, last_write):
+        self.buckets = {}  # hour index -> Counter(mood -> count)
+        self.built_at = built_at
+        self.last_write = last_write  # newest created_at counted, or None
+        self.totals = None  # window -> Counter, valid while the hour is totals_hour
+        self.totals_hour = None
+
+
+class MoodRollup:
+    """Thread-safe, bounded store of hourly mood counts keyed by user id.
+
+    Window edges are resolved to the hour, so a window may include up to one
+    extra hour of entries at its oldest end.
+    """
+
+    def __init__(self, max_age=300, max_users=1024):
+        self.max_age = max_age
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._users = OrderedDict()
+
+    def _add_rows(self, rollup, rows, now):
+        oldest = (now - RETENTION_SECONDS) // BUCKET_SECONDS
+        for row in rows:
+            moods = split_moods(row.get("mood"))
+            if not moods:
+                continue
+            created_at = row.get("created_at")
+            ts = parse_timestamp(created_at) if created_at else now
+            bucket = int(ts // BUCKET_SECONDS)
+            if bucket < oldest:
+                continue
+            rollup.buckets.setdefault(bucket, Counter()).update(moods)
+            if rollup.totals is not None:
+                age = now - (bucket + 1) * BUCKET_SECONDS
+                for window, days in WINDOWS.items():
+                    if age <= days * 86400:
+                        rollup.totals[window].update(moods)
+
+    def rebuild(self, user_id, decoded, now=None):
+        """Replace a user's rollup with counts computed from ``DecodedMoods``."""
+        now = time.time() if now is None else now
+        rollup = _UserRollup(built_at=now, last_write=decoded.last_created_at)
+        start = decoded.start_index(int(now - RETENTION_SECONDS))
+        times, ids = decoded.times[start:], decoded.ids[start:]
+        positions = range(len(times))
+        for bucket, group in groupby(positions, key=lambda i: times[i] // BUCKET_SECONDS):
+            counts = Counter(ids[i] for i in group)
+            rollup.buckets[bucket] = Counter({decoded.vocabulary.names[i]: n for i, n in counts.items()})
+        with self._lock:
+            self._users[user_id] = rollup
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+
+    def last_write(self, user_id, now=None):
+        """``(True, created_at)`` for a loaded, fresh rollup, else ``(False, None)``."""
+        now = time.time() if now is None else now
+        with self._lock:
+            rollup = self._users.get(user_id)
+            if rollup is None or now - rollup.built_at > self.max_age:
+                return False, None
+            return True, rollup.last_write
+
+    def apply(self, user_id, rows, last_write, now=None):
+        """Fold rows written after ``last_write`` into a user's rollup.
+
+        Nothing happens unless the rollup still ends at ``last_write``, so two
+        requests catching up on the same rows can't count them twice.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            rollup = self._users.get(user_id)
+            if rollup is None or rollup.last_write != last_write:
+                return
+            self._add_rows(rollup, rows, now)
+            if rows:
+                rollup.last_write = max(
+                    (row["created_at"] for row in rows), key=parse_timestamp
+                )
+
+    def counts(self, user_id, last_write, now=None):
+        """Return ``{window: {mood: count}}``, or None if the rollup is missing,
+        expired or doesn't end at ``last_write``."""
+        now = time.time() if now is None else now
+        with self._lock:
+            rollup = self._users.get(user_id)
+            if rollup is None or now - rollup.built_at > self.max_age:
+                return None
+            if rollup.last_write != last_write:
+                return None
+            self._users.move_to_end(user_id)
+
+            hour = int(now // BUCKET_SECONDS)
+            if rollup.totals is None or rollup.totals_hour != hour:
+                rollup.totals = self._totals(rollup, now)
+                rollup.totals_hour = hour
+            return {window: dict(counter) for window, counter in rollup.totals.items()}
+
+    def _totals(self, rollup, now):
+        oldest = (now - RETENTION_SECONDS) // BUCKET_SECONDS
+        for bucket in [b for b in rollup.buckets if b < oldest]:
+            del rollup.buckets[bucket]
+
+        # Walk buckets newest first with one running total, snapshotting it as
+        # each window's edge is passed
+        windows = sorted(WINDOWS.items(), key=lambda item: item[1])
+        totals = {}
+        running = Counter()
+        for bucket in sorted(rollup.buckets, reverse=True):
+            age = now - (bucket + 1) * BUCKET_SECONDS
+            while windows and age > windows[0][1] * 86400:
+                totals[windows.pop(0)[0]] = Counter(running)
+            if not windows:
+                break
+            running.update(rollup.buckets[bucket])
+        for window, _ in windows:
+            totals[window] = Counter(running)
+        return totals
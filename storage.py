@@ -0,0 +1,309 @@
+"""Storage backends for users and moods.
+
+The routes only talk to a ``Storage``; ``SupabaseStorage`` wraps the hosted
+Supabase project and ``SQLiteStorage`` keeps everything in a local, indexed
+SQLite file for self-hosted deployments and offline testing.  Pick one with
+``STORAGE_BACKEND`` (``supabase`` or ``sqlite``).
+"""
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+import os
+import sqlite3
+import threading
+
+USER_COLUMNS = "id, email, username"
+
+# PostgREST caps responses at the project's max_rows (1000 by default)
+SUPABASE_PAGE_SIZE = 1000
+
+
+class Storage(ABC):
+    """Operations the routes need. Rows are returned as plain dicts."""
+
+    @abstractmethod
+    def get_user(self, user_id):
+        """Return ``{id, email, username}`` for a user id, or None."""
+
+    @abstractmethod
+    def find_users(self, email, username, with_password=False):
+        """Return users whose email or username matches, in one lookup."""
+
+    @abstractmethod
+    def create_user(self, email, password_hash, username):
+        """Insert a user and return it with its id."""
+
+    @abstractmethod
+    def insert_moods(self, rows):
+        """Insert mood rows in one batch and return them with id and created_at."""
+
+    @abstractmethod
+    def moods_since(self, user_id, since, moods=()):
+        """Return ``{mood, created_at}`` rows at or after ``since``, oldest first.
+
+        ``moods`` narrows the rows the same way as in ``list_moods``.
+        """
+
+    @abstractmethod
+    def last_mood_at(self, user_id):
+        """Return the newest ``created_at`` for a user, or None."""
+
+    @abstractmethod
+    def list_moods(self, user_id, limit, since=None, until=None, moods=(), after=None):
+        """Return up to ``limit`` ``{id, mood, note, created_at}`` rows, newest first.
+
+        ``after`` is a ``(created_at, id)`` keyset position; only older rows
+        are returned. ``moods`` narrows to rows whose mood column contains any
+        of the names, case-insensitively (callers check exact names).
+        """
+
+
+def postgrest_value(value):
+    # Quote a value for use inside a PostgREST or=(...) filter
+    escaped = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{escaped}"'
+
+
+def mood_ilike_filter(moods):
+    # or=(...) expression matching rows whose mood column contains any name
+    return ",".join(f"mood.ilike.{postgrest_value(f'*{m}*')}" for m in moods)
+
+
+class SupabaseStorage(Storage):
+    def __init__(self, client):
+        self.client = client
+
+    @classmethod
+    def from_env(cls):
+        from supabase import create_client
+        return cls(create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY")))
+
+    def get_user(self, user_id):
+        rows = self.client.table("users").select(USER_COLUMNS).eq("id", user_id).execute().data
+        return rows[0] if rows else None
+
+    def find_users(self, email, username, with_password=False):
+        columns = USER_COLUMNS + ", password" if with_password else USER_COLUMNS
+        return self.client.table("users").select(columns).or_(
+            f"email.eq.{postgrest_value(email)},username.eq.{postgrest_value(username)}"
+        ).execute().data
+
+    def create_user(self, email, password_hash, username):
+        rows = self.client.table("users").insert({
+            "email": email,
+            "password": password_hash,
+            "username": username
+        }).execute().data
+        return rows[0] if rows else None
+
+    def insert_moods(self, rows):
+        return self.client.table("moods").insert(rows).execute().data
+
+    def moods_since(self, user_id, since, moods=()):
+        # Page through with .range() until a short page, since one request
+        # would be silently truncated at max_rows
+        rows = []
+        while True:
+            query = (
+                self.client.table("moods")
+                .select("mood, created_at")
+                .eq("user_id", user_id)
+                .gte("created_at", since.isoformat())
+            )
+            if moods:
+                query = query.or_(mood_ilike_filter(moods))
+            page = (
+                query.order("created_at").order("id")
+                .range(len(rows), len(rows) + SUPABASE_PAGE_SIZE - 1)
+                .execute()
+                .data
+            )
+            rows.extend(page)
+            if len(page) < SUPABASE_PAGE_SIZE:
+                return rows
+
+    def last_mood_at(self, user_id):
+        rows = (
+            self.client.table("moods")
+            .select("created_at")
+            .eq("user_id", user_id)
+            .order("created_at", desc=True)
+            .limit(1)
+            .execute()
+            .data
+        )
+        return rows[0]["created_at"] if rows else None
+
+    def list_moods(self, user_id, limit, since=None, until=None, moods=(), after=None):
+        query = (
+            self.client.table("moods")
+            .select("id, mood, note, created_at")
+            .eq("user_id", user_id)
+        )
+        if since:
+            query = query.gte("created_at", since)
+        if until:
+            query = query.lt("created_at", until)
+        if moods:
+            query = query.or_(mood_ilike_filter(moods))
+        if after:
+            created_at, row_id = after
+            query = query.or_(
+                f"created_at.lt.{postgrest_value(created_at)},"
+                f"and(created_at.eq.{postgrest_value(created_at)},id.lt.{postgrest_value(row_id)})"
+            )
+        return query.order("created_at", desc=True).order("id", desc=True).limit(limit).execute().data
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    email TEXT NOT NULL,
+    username TEXT NOT NULL,
+    password TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS users_email ON users(email);
+CREATE UNIQUE INDEX IF NOT EXISTS users_username ON users(username);
+CREATE TABLE IF NOT EXISTS moods (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    mood TEXT NOT NULL,
+    note TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS moods_user_created ON moods(user_id, created_at);
+"""
+
+
+def sqlite_timestamp(value=None):
+    """Canonical UTC ISO form, so timestamps compare correctly as text."""
+    if value is None:
+        value = datetime.now(timezone.utc)
+    elif isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+
+def _like_pattern(value):
+    escaped = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def _mood_filter(moods):
+    return "(" + " OR ".join("mood LIKE ? ESCAPE '\\'" for _ in moods) + ")"
+
+
+class SQLiteStorage(Storage):
+    """SQLite in WAL mode with one connection per thread, reopened after fork."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.executescript(SQLITE_SCHEMA)
+
+    @classmethod
+    def from_env(cls):
+        return cls(os.getenv("SQLITE_PATH", "mood_tracker.db"))
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _query(self, sql, params=()):
+        return [dict(row) for row in self._connection().execute(sql, params)]
+
+    def get_user(self, user_id):
+        rows = self._query(f"SELECT {USER_COLUMNS} FROM users WHERE id = ?", (user_id,))
+        return rows[0] if rows else None
+
+    def find_users(self, email, username, with_password=False):
+        columns = USER_COLUMNS + ", password" if with_password else USER_COLUMNS
+        return self._query(
+            f"SELECT {columns} FROM users WHERE email = ? "
+            f"UNION SELECT {columns} FROM users WHERE username = ?",
+            (email, username),
+        )
+
+    def create_user(self, email, password_hash, username):
+        created_at = sqlite_timestamp()
+        with self._connection() as conn:
+            cursor = conn.execute(
+                "INSERT INTO users (email, username, password, created_at) VALUES (?, ?, ?, ?)",
+                (email, username, password_hash, created_at),
+            )
+        return {"id": cursor.lastrowid, "email": email, "username": username, "created_at": created_at}
+
+    def insert_moods(self, rows):
+        inserted = []
+        with self._connection() as conn:
+            for row in rows:
+                row = dict(row)
+                row["created_at"] = sqlite_timestamp(row.get("created_at"))
+                cursor = conn.execute(
+                    "INSERT INTO moods (user_id, mood, note, created_at) VALUES (?, ?, ?, ?)",
+                    (row["user_id"], row["mood"], row.get("note"), row["created_at"]),
+                )
+                row["id"] = cursor.lastrowid
+                inserted.append(row)
+        return inserted
+
+    def moods_since(self, user_id, since, moods=()):
+        where, params = ["user_id = ?", "created_at >= ?"], [user_id, sqlite_timestamp(since)]
+        if moods:
+            where.append(_mood_filter(moods))
+            params.extend(_like_pattern(m) for m in moods)
+        return self._query(
+            "SELECT mood, created_at FROM moods WHERE " + " AND ".join(where) + " ORDER BY created_at",
+            params,
+        )
+
+    def last_mood_at(self, user_id):
+        rows = self._query(
+            "SELECT created_at FROM moods WHERE user_id = ? ORDER BY created_at DESC LIMIT 1",
+            (user_id,),
+        )
+        return rows[0]["created_at"] if rows else None
+
+    def list_moods(self, user_id, limit, since=None, until=None, moods=(), after=None):
+        where, params = ["user_id = ?"], [user_id]
+        if since:
+            where.append("created_at >= ?")
+            params.append(sqlite_timestamp(since))
+        if until:
+            where.append("created_at < ?")
+            params.append(sqlite_timestamp(until))
+        if moods:
+            where.append(_mood_filter(moods))
+            params.extend(_like_pattern(m) for m in moods)
+        if after:
+            created_at, row_id = after
+            created_at = sqlite_timestamp(created_at)
+            where.append("(created_at < ? OR (created_at = ? AND id < ?))")
+            params.extend([created_at, created_at, row_id])
+        params.append(limit)
+        return self._query(
+            "SELECT id, mood, note, created_at FROM moods WHERE " + " AND ".join(where)
+            + " ORDER BY created_at DESC, id DESC LIMIT ?",
+            params,
+        )
+
+
+BACKENDS = {"supabase": SupabaseStorage, "sqlite": SQLiteStorage}
+
+
+def create_storage(backend=None):
+    backend = (backend or os.getenv("STORAGE_BACKEND", "supabase")).lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}, expected one of {', '.join(BACKENDS)}")
+    return BACKENDS[backend].from_env()
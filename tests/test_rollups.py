@@ -0,0 +1,151 @@
+"""Mood rollups: rebuilds, catching up on other workers' writes, and apply()."""
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+import os
+import random
+import tempfile
+import threading
+import unittest
+
+# app.py builds its storage on import; point it at a scratch SQLite file
+_tmp = tempfile.TemporaryDirectory()
+os.environ.update({
+    "STORAGE_BACKEND": "sqlite",
+    "SQLITE_PATH": os.path.join(_tmp.name, "moods.db"),
+    "BCRYPT_LOG_ROUNDS": "4",
+})
+
+import app  # noqa: E402
+from mood_codec import DecodedMoods, split_moods  # noqa: E402
+from rollups import WINDOWS, MoodRollup  # noqa: E402
+from storage import SQLiteStorage, sqlite_timestamp  # noqa: E402
+
+MOODS = ["Happy", "Sad", "Calm", "Happy, Tired", "Sad,Calm,Homesick"]
+
+
+def tearDownModule():
+    _tmp.cleanup()
+
+
+def history(count, seed, now):
+    """Rows spread over ~400 days, kept clear of the hour-resolved window edges."""
+    rng = random.Random(seed)
+    edges = [days * 86400 for days in WINDOWS.values()]
+    rows = []
+    while len(rows) < count:
+        age = rng.uniform(60, 400 * 86400)
+        if any(abs(age - edge) < 2 * 3600 for edge in edges):
+            continue
+        rows.append({
+            "mood": rng.choice(MOODS),
+            "note": "",
+            "created_at": sqlite_timestamp(now - timedelta(seconds=age)),
+        })
+    return rows
+
+
+def brute_force(rows, now):
+    counts = {window: Counter() for window in WINDOWS}
+    for row in rows:
+        age = (now - datetime.fromisoformat(row["created_at"])).total_seconds()
+        for window, days in WINDOWS.items():
+            if age <= days * 86400:
+                counts[window].update(split_moods(row["mood"]))
+    return {window: dict(counter) for window, counter in counts.items()}
+
+
+class RebuildTests(unittest.TestCase):
+    def test_rebuild_matches_brute_force(self):
+        now = datetime.now(timezone.utc)
+        rows = history(500, seed=1, now=now)
+        decoded = DecodedMoods.from_rows(rows)
+        rollup = MoodRollup()
+        rollup.rebuild(1, decoded, now=now.timestamp())
+
+        self.assertEqual(decoded.last_created_at, max(row["created_at"] for row in rows))
+        self.assertEqual(rollup.counts(1, decoded.last_created_at, now=now.timestamp()), brute_force(rows, now))
+
+    def test_counts_miss_when_last_write_moved(self):
+        now = datetime.now(timezone.utc)
+        rows = history(20, seed=2, now=now)
+        rollup = MoodRollup()
+        rollup.rebuild(1, DecodedMoods.from_rows(rows), now=now.timestamp())
+
+        self.assertIsNone(rollup.counts(1, sqlite_timestamp(now), now=now.timestamp()))
+
+
+class CatchUpTests(unittest.TestCase):
+    def setUp(self):
+        email = f"user{self.id()}@example.com"
+        self.user_id = app.storage.create_user(email, "x", email)["id"]
+        # Stands in for another gunicorn worker writing to the same database
+        self.other_worker = SQLiteStorage(os.environ["SQLITE_PATH"])
+
+    def insert(self, rows):
+        return self.other_worker.insert_moods([dict(row, user_id=self.user_id) for row in rows])
+
+    def test_catches_up_on_other_workers_writes_without_rebuilding(self):
+        now = datetime.now(timezone.utc)
+        rows = self.insert(history(200, seed=3, now=now))
+        self.assertEqual(app.load_mood_counts(self.user_id), brute_force(rows, datetime.now(timezone.utc)))
+        built_at = app.mood_rollup._users[self.user_id].built_at
+
+        # The catch-up query also returns the rollup's newest row again (it's
+        # inclusive), which must not be counted twice
+        rows += self.insert([{"mood": "Happy, Sad", "note": ""}, {"mood": "Calm", "note": ""}])
+
+        self.assertEqual(app.load_mood_counts(self.user_id), brute_force(rows, datetime.now(timezone.utc)))
+        self.assertEqual(app.mood_rollup._users[self.user_id].built_at, built_at)
+
+    def test_repeat_views_without_writes_are_unchanged(self):
+        rows = self.insert(history(50, seed=4, now=datetime.now(timezone.utc)))
+        first = app.load_mood_counts(self.user_id)
+        self.assertEqual(app.load_mood_counts(self.user_id), first)
+        self.assertEqual(first, brute_force(rows, datetime.now(timezone.utc)))
+
+    def test_first_write_for_user_with_empty_rollup(self):
+        self.assertEqual(app.load_mood_counts(self.user_id), {window: {} for window in WINDOWS})
+        self.insert([{"mood": "Happy", "note": ""}])
+        self.assertEqual(app.load_mood_counts(self.user_id), {window: {"Happy": 1} for window in WINDOWS})
+
+
+class ApplyTests(unittest.TestCase):
+    def test_concurrent_apply_on_same_watermark_counts_once(self):
+        now = datetime.now(timezone.utc)
+        rows = history(30, seed=5, now=now - timedelta(hours=1))
+        decoded = DecodedMoods.from_rows(rows)
+        rollup = MoodRollup()
+        rollup.rebuild(1, decoded)
+        newer = [{"mood": "Happy", "created_at": sqlite_timestamp(now)}]
+
+        barrier = threading.Barrier(8)
+
+        def catch_up():
+            barrier.wait()
+            rollup.apply(1, newer, decoded.last_created_at)
+
+        threads = [threading.Thread(target=catch_up) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(rollup.counts(1, newer[0]["created_at"]), brute_force(rows + newer, now))
+
+    def test_apply_on_stale_watermark_is_ignored(self):
+        now = datetime.now(timezone.utc)
+        rows = history(30, seed=6, now=now - timedelta(hours=1))
+        decoded = DecodedMoods.from_rows(rows)
+        rollup = MoodRollup()
+        rollup.rebuild(1, decoded)
+        first = [{"mood": "Sad", "created_at": sqlite_timestamp(now - timedelta(minutes=1))}]
+        rollup.apply(1, first, decoded.last_created_at)
+
+        rollup.apply(1, [{"mood": "Calm", "created_at": sqlite_timestamp(now)}], decoded.last_created_at)
+
+        self.assertIsNone(rollup.counts(1, sqlite_timestamp(now)))
+        self.assertEqual(rollup.counts(1, first[0]["created_at"]), brute_force(rows + first, now))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+"""Write-behind queue that coalesces mood rows into bulk inserts.
+
+Requests hand their rows to ``submit()`` and return immediately; a background
+thread waits up to ``max_delay`` after the first row for more to arrive,
+writes them in a single ``flush`` call, retries failed batches with backoff
+and flushes anything left over when the process exits.  A batch that still
+fails is written one submission at a time, so only the submissions that
+can't be written are lost.
+"""
+import atexit
+import queue
+import threading
+import time
+
+
+class WriteBehindQueue:
+    def __init__(self, flush, max_batch=500, max_delay=0.5, max_retries=3,
+                 retry_backoff=0.5, max_pending=10000):
+        self.flush = flush  # called with a list of rows, must raise on failure
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        atexit.register(self.close)
+
+    def _ensure_started(self):
+        # Started lazily so each gunicorn worker gets its own thread after fork
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="mood-write-behind", daemon=True)
+                self._thread.start()
+
+    def submit(self, rows):
+        """Queue rows for writing. Returns False if the queue is full or closed."""
+        if self._stopping.is_set():
+            return False
+        try:
+            self._queue.put_nowait(list(rows))
+        except queue.Full:
+            return False
+        self._ensure_started()
+        return True
+
+    def _drain(self, block):
+        """Collect queued submissions, up to ``max_batch`` rows.
+
+        When ``block`` is set, wait for a first submission and then keep
+        taking more until ``max_delay`` has passed since it arrived.
+        """
+        batch, size, deadline = [], 0, None
+        while size < self.max_batch:
+            try:
+                if not block:
+                    rows = self._queue.get_nowait()
+                elif deadline is None:
+                    rows = self._queue.get(timeout=self.max_delay)
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    rows = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if deadline is None:
+                deadline = time.monotonic() + self.max_delay
+            batch.append(rows)
+            size += len(rows)
+        return batch
+
+    def _flush_with_retries(self, rows):
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.flush(rows)
+                return True
+            except Exception as e:
+                print(f"Write-behind flush failed (attempt {attempt + 1}): {e}")
+                if attempt < self.max_retries and not self._stopping.is_set():
+                    time.sleep(self.retry_backoff * (2 ** attempt))
+        return False
+
+    def _write(self, batch):
+        if self._flush_with_retries([row for rows in batch for row in rows]):
+            return
+        if len(batch) > 1:
+            # One bad row fails the whole bulk insert; write each submission
+            # on its own so the others still get saved
+            print(f"Writing {len(batch)} submissions separately")
+            batch = [rows for rows in batch if not self._flush_once(rows)]
+        for rows in batch:
+            print(f"Dropping {len(rows)} mood rows that could not be written")
+
+    def _flush_once(self, rows):
+        try:
+            self.flush(rows)
+            return True
+        except Exception as e:
+            print(f"Write-behind flush failed: {e}")
+            return False
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._drain(block=True)
+            if batch:
+                self._write(batch)
+
+    def close(self, timeout=10):
+        """Stop the worker and synchronously flush anything still queued."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        while True:
+            batch = self._drain(block=False)
+            if not batch:
+                break
+            self._write(batch)